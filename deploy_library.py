@@ -1,30 +1,65 @@
 import os
+import errno
 import sys
+import stat
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+import venv
 import zipfile
+import io
+import mmap
 import tempfile
 import shutil
 import logging
+import hashlib
+import functools
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 REPO_URL_ENV_VAR = "PYTHON_LIB_GITHUB_URL"
+BRANCH_ENV_VAR = "PYTHON_LIB_GITHUB_BRANCH"
+EXPECTED_SHA256_ENV_VAR = "PYTHON_LIB_EXPECTED_SHA256"
 DEFAULT_BRANCH = "main"
+FALLBACK_BRANCHES = (DEFAULT_BRANCH, "master")
+ZIP_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+PARALLEL_EXTRACT_MIN_MEMBERS = 64
+
+_BIN_DIR = "Scripts" if os.name == "nt" else "bin"
+_PIP_EXE = "pip.exe" if os.name == "nt" else "pip"
+_PY_EXE = "python.exe" if os.name == "nt" else "python"
+_REPO_NAME_RE = re.compile(r"/([^/]+?)(?:/archive(?:/.*)?)?/?$")
+# Runs inside the venv: the distribution installed from a URL is the one with direct_url.json.
+_INSTALLED_PACKAGE_CODE = (
+    "import importlib.metadata as md\n"
+    "for dist in md.distributions():\n"
+    "    if dist.read_text('direct_url.json') is None:\n"
+    "        continue\n"
+    "    dist_name = dist.metadata['Name']\n"
+    "    names = sorted(n for n, dists in md.packages_distributions().items()\n"
+    "                   if dist_name in dists and n.isidentifier() and not n.startswith('_'))\n"
+    "    if names:\n"
+    "        print(names[0])\n"
+    "        break\n"
+)
+
+# Shared session keeps connections alive between branch probes, retries and downloads.
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=3)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
 
 def get_repo_name_from_url(repo_url: str) -> str | None:
     """Extract repository name from GitHub URL or zip link."""
     try:
-        path_parts = [p for p in urlparse(repo_url).path.split("/") if p]
-        if not path_parts:
-            return None
-        if "archive" in path_parts:
-            idx = path_parts.index("archive") - 1
-            if idx >= 0:
-                return path_parts[idx]
-        return path_parts[-1].removesuffix(".zip")
+        match = _REPO_NAME_RE.search(urlparse(repo_url).path)
+        return match.group(1).removesuffix(".zip") if match else None
     except Exception as exc:
         logging.error(f"Не удалось определить имя репозитория: {exc}")
         return None
@@ -37,42 +72,190 @@ def get_repo_url_from_env():
         return None
     return repo_url.strip()
 
+def get_expected_sha256_from_env():
+    """Return expected archive SHA-256 from environment variable, if set."""
+    expected = os.environ.get(EXPECTED_SHA256_ENV_VAR, "").strip().lower()
+    return expected or None
+
+def _branch_zip_url(repo_url, branch):
+    """Return archive URL of a branch of the repository."""
+    return f"{repo_url.rstrip('/')}/archive/refs/heads/{branch}.zip"
+
+def _zip_url_exists(zip_url):
+    """Check with a HEAD request whether archive URL is available."""
+    try:
+        response = _SESSION.head(zip_url, allow_redirects=True, timeout=30)
+        return response.status_code == 200
+    except Exception as exc:
+        logging.warning(f"Не удалось проверить {zip_url}: {exc}")
+        return False
+
+def build_zip_url(repo_url):
+    """Return archive URL for repository URL or zip link.
+
+    The branch is taken from BRANCH_ENV_VAR; if it is not set, the
+    FALLBACK_BRANCHES are probed concurrently and the first available one
+    in that order is used.
+    """
+    if repo_url.endswith(".zip"):
+        return repo_url
+    branch = os.environ.get(BRANCH_ENV_VAR, "").strip()
+    if branch:
+        return _branch_zip_url(repo_url, branch)
+    candidates = [_branch_zip_url(repo_url, name) for name in FALLBACK_BRANCHES]
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        available = list(executor.map(_zip_url_exists, candidates))
+    for candidate, exists in zip(candidates, available):
+        if exists:
+            return candidate
+    return candidates[0]
+
 def download_repo_zip(repo_url, temp_dir_path):
-    """Download repository archive and return path to the zip file."""
+    """Download repository archive into a spooled buffer and return it.
+
+    The archive stays in memory unless it exceeds ZIP_SPOOL_MAX_SIZE, in which
+    case it spills to a temporary file inside temp_dir_path.
+    """
+    zip_buffer = None
     try:
-        if repo_url.endswith(".zip"):
-            zip_url = repo_url
-        else:
-            cleaned = repo_url.rstrip("/")
-            zip_url = f"{cleaned}/archive/refs/heads/{DEFAULT_BRANCH}.zip"
-        response = requests.get(zip_url, stream=True, timeout=30)
-        response.raise_for_status()
-        zip_file_path = Path(temp_dir_path) / "repo.zip"
-        with open(zip_file_path, "wb") as fh:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    fh.write(chunk)
-        logging.info(f"Архив скачан: {zip_file_path}")
-        return zip_file_path
+        zip_url = build_zip_url(repo_url)
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE, dir=temp_dir_path)
+        with _SESSION.get(zip_url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > ZIP_SPOOL_MAX_SIZE:
+                # Archive will spill anyway: write to disk from the start instead of buffering then copying.
+                zip_buffer.rollover()
+            response.raw.decode_content = True
+            hasher = hashlib.sha256()
+            read = response.raw.read
+            write = zip_buffer.write
+            update = hasher.update
+            while chunk := read(COPY_CHUNK_SIZE):
+                write(chunk)
+                update(chunk)
+        digest = hasher.hexdigest()
+        expected_sha256 = get_expected_sha256_from_env()
+        if expected_sha256 and digest != expected_sha256:
+            raise ValueError(f"SHA-256 архива {digest} не совпадает с ожидаемым {expected_sha256}")
+        zip_buffer.seek(0)
+        logging.info(f"Архив скачан: {zip_url} (SHA-256 {digest})")
+        return zip_buffer
     except Exception as exc:
+        if zip_buffer is not None:
+            zip_buffer.close()
         logging.error(f"Не удалось скачать архив: {exc}")
         return None
 
-def extract_repo_zip(zip_path, extract_to_dir_path):
-    """Extract zip archive to directory."""
+def _member_arcname(filename):
+    """Return member name as a native relative path, sanitised like ZipFile.extractall."""
+    arcname = filename.replace("/", os.sep)
+    if os.name == "nt":
+        # Without this ':' would write to an NTFS alternate stream and '?'/'*' would fail.
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.sep)
+    return arcname
+
+def _zip_member_target(name, extract_root):
+    """Return destination path for zip member, rejecting paths outside root."""
+    target = os.path.normpath(os.path.join(extract_root, name))
+    if target != extract_root and not target.startswith(os.path.join(extract_root, "")):
+        raise ValueError(f"Недопустимый путь в архиве: {name}")
+    return target
+
+class _MappedZipReader(io.RawIOBase):
+    """Read-only seekable file object over a memory map."""
+
+    def __init__(self, mapping):
+        super().__init__()
+        self._mapping = mapping
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._mapping)
+        if offset < 0:
+            # Same error as a real file, which zipfile expects when probing short archives.
+            raise OSError(errno.EINVAL, f"negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self._mapping) if size is None or size < 0 else self._pos + size
+        data = self._mapping[self._pos:end]
+        self._pos += len(data)
+        return data
+
+def _map_zip_source(zip_source):
+    """Memory-map archive stored on disk; return None for in-memory sources."""
+    if isinstance(zip_source, (str, os.PathLike)):
+        with open(zip_source, "rb") as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    # A spooled file only gets a name once it has rolled over to disk.
+    if getattr(zip_source, "name", None) is not None:
+        zip_source.flush()
+        return mmap.mmap(zip_source.fileno(), 0, access=mmap.ACCESS_READ)
+    return None
+
+def extract_repo_zip(zip_source, extract_to_dir_path):
+    """Extract zip archive (path or binary file object) using parallel worker threads."""
+    mapping = None
+
+    def _extract_one(item):
+        info, target = item
+        # The ZipFile is shared: zipfile serialises the raw reads with its own lock
+        # (memory slices for a mapped archive) while decompression runs in parallel.
+        with zip_ref.open(info) as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=COPY_CHUNK_SIZE)
+
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to_dir_path)
+        extract_root = os.path.realpath(extract_to_dir_path)
+        workers = os.cpu_count() or 1
+        mapping = _map_zip_source(zip_source)
+        zip_file = zip_source if mapping is None else _MappedZipReader(mapping)
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            members = zip_ref.infolist()
+            if workers == 1 or len(members) < PARALLEL_EXTRACT_MIN_MEMBERS:
+                # Thread start-up and per-member bookkeeping would only slow these down.
+                zip_ref.extractall(extract_root)
+            else:
+                files = []
+                dirs = set()
+                for info in members:
+                    target = _zip_member_target(_member_arcname(info.filename), extract_root)
+                    if info.is_dir():
+                        dirs.add(target)
+                    else:
+                        dirs.add(os.path.dirname(target))
+                        files.append((info, target))
+                for directory in sorted(dirs):
+                    os.makedirs(directory, exist_ok=True)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(_extract_one, files))
         logging.info(f"Архив распакован в {extract_to_dir_path}")
         return extract_to_dir_path
     except Exception as exc:
         logging.error(f"Не удалось распаковать архив: {exc}")
         return None
+    finally:
+        if mapping is not None:
+            mapping.close()
 
 def find_library_root(extract_to_dir_path):
     """Find top-level library directory."""
     try:
-        dirs = [p for p in Path(extract_to_dir_path).iterdir() if p.is_dir()]
+        with os.scandir(extract_to_dir_path) as entries:
+            dirs = [Path(e.path) for e in entries if e.is_dir(follow_symlinks=False)]
         if len(dirs) != 1:
             logging.error("Не удалось определить корневую папку библиотеки.")
             return None
@@ -85,9 +268,10 @@ def find_library_root(extract_to_dir_path):
 def guess_package_name(library_root: Path) -> str | None:
     """Attempt to determine Python package name from library root."""
     try:
-        candidates = [p for p in library_root.iterdir() if (p / "__init__.py").is_file()]
-        if candidates:
-            return candidates[0].name
+        with os.scandir(library_root) as entries:
+            for entry in entries:
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, "__init__.py")):
+                    return entry.name
     except Exception as exc:
         logging.error(f"Ошибка определения имени пакета: {exc}")
     return library_root.name
@@ -95,10 +279,8 @@ def guess_package_name(library_root: Path) -> str | None:
 def create_virtual_env(venv_path):
     """Create virtual environment."""
     try:
-        result = subprocess.run([sys.executable, "-m", "venv", str(venv_path)], capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.error(f"Не удалось создать виртуальное окружение: {result.stderr}")
-            return False
+        builder = venv.EnvBuilder(with_pip=True, symlinks=(os.name != "nt"), clear=False)
+        builder.create(str(venv_path))
         logging.info(f"Виртуальное окружение создано по пути {venv_path}")
         return True
     except Exception as exc:
@@ -107,11 +289,21 @@ def create_virtual_env(venv_path):
 
 def install_library_in_venv(venv_path, library_source_path):
     """Install library into virtual environment."""
-    pip_dir = "Scripts" if os.name == "nt" else "bin"
-    pip_exe = "pip.exe" if os.name == "nt" else "pip"
-    pip_path = Path(venv_path) / pip_dir / pip_exe
+    bin_path = Path(venv_path) / _BIN_DIR
+    pip_path = bin_path / _PIP_EXE
+    python_path = bin_path / _PY_EXE
+    uv_path = shutil.which("uv")
+    if uv_path:
+        # uv resolves and unpacks dependencies in parallel; fall back to the venv's pip when absent.
+        command = [uv_path, "pip", "install", "--python", str(python_path), "--quiet", str(library_source_path)]
+    else:
+        command = [
+            str(pip_path), "install", "--quiet", "--no-warn-script-location",
+            "--disable-pip-version-check", str(library_source_path),
+        ]
     try:
-        result = subprocess.run([str(pip_path), "install", str(library_source_path)], capture_output=True, text=True)
+        # Only stderr is reported, so stdout is discarded instead of piped and decoded.
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
         if result.returncode != 0:
             logging.error(f"Ошибка установки библиотеки: {result.stderr}")
             return False
@@ -121,13 +313,10 @@ def install_library_in_venv(venv_path, library_source_path):
         logging.error(f"Не удалось установить библиотеку: {exc}")
         return False
 
-def run_demonstration(venv_path, library_name):
-    """Run small demonstration script inside virtual environment."""
-    python_dir = "Scripts" if os.name == "nt" else "bin"
-    python_exe = "python.exe" if os.name == "nt" else "python"
-    python_path = Path(venv_path) / python_dir / python_exe
-    demo_script = Path(venv_path) / "demo_script.py"
-    demo_code = (
+@functools.lru_cache(maxsize=8)
+def _demo_source(library_name):
+    """Return demonstration code printing the library version."""
+    return (
         "import sys\n"
         "if hasattr(sys.stdout, 'reconfigure'):\n"
         "    sys.stdout.reconfigure(encoding='utf-8')\n"
@@ -135,14 +324,31 @@ def run_demonstration(venv_path, library_name):
         f"version = getattr({library_name}, '__version__', getattr({library_name}, 'version', 'unknown'))\n"
         f"print(f'Версия библиотеки {library_name}: {{version}}')\n"
     )
+
+def find_installed_package_name(venv_path):
+    """Return top-level import name of library installed from URL into venv."""
+    python_path = Path(venv_path) / _BIN_DIR / _PY_EXE
     try:
-        demo_script.write_text(demo_code, encoding="utf-8")
+        result = subprocess.run([str(python_path), "-c", _INSTALLED_PACKAGE_CODE], capture_output=True, text=True)
+        package_name = result.stdout.strip()
+        if result.returncode == 0 and package_name:
+            logging.info(f"Найден установленный пакет: {package_name}")
+            return package_name
+        logging.warning(f"Не удалось определить установленный пакет: {result.stderr.strip()}")
+    except Exception as exc:
+        logging.warning(f"Ошибка определения установленного пакета: {exc}")
+    return None
 
+def run_demonstration(venv_path, library_name):
+    """Run small demonstration script inside virtual environment."""
+    python_path = Path(venv_path) / _BIN_DIR / _PY_EXE
+    demo_code = _demo_source(library_name)
+    try:
         orig_pyio = os.environ.get("PYTHONIOENCODING")
         os.environ["PYTHONIOENCODING"] = "utf-8"
         try:
             result = subprocess.run(
-                [str(python_path), str(demo_script)],
+                [str(python_path), "-c", demo_code],
                 capture_output=True,
             )
         finally:
@@ -163,24 +369,69 @@ def run_demonstration(venv_path, library_name):
             logging.warning(f"Сообщения ошибки демонстрации: {stderr.strip()}")
     except Exception as exc:
         logging.error(f"Ошика выполнения демонстрации: {exc}")
-    finally:
-        if demo_script.exists():
-            demo_script.unlink()
+
+def _remove_readonly(func, path, exc):
+    """rmtree error handler: clear the read-only flag and retry the removal."""
+    error = exc[1] if isinstance(exc, tuple) else exc
+    if isinstance(error, FileNotFoundError):
+        return
+    # Only removal calls can be retried; rmtree also reports os.open, os.scandir, os.lstat, etc.
+    if func not in (os.unlink, os.remove, os.rmdir):
+        logging.warning(f"Не удалось обработать {path} ({getattr(func, '__name__', func)}): {error}")
+        return
+    try:
+        mode = stat.S_IWRITE | stat.S_IREAD
+        if stat.S_ISDIR(os.lstat(path).st_mode):
+            mode |= stat.S_IEXEC
+        os.chmod(path, mode)
+        func(path)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logging.warning(f"Не удалось удалить {path}: {exc}")
 
 def cleanup(paths_to_remove):
     """Remove temporary directories."""
     for path in paths_to_remove:
         try:
-            shutil.rmtree(path, ignore_errors=True)
+            if sys.version_info >= (3, 12):
+                shutil.rmtree(path, onexc=_remove_readonly)
+            else:
+                shutil.rmtree(path, onerror=_remove_readonly)
             logging.info(f"Удалена директория {path}")
         except Exception as exc:
             logging.error(f"Не удалось удалить {path}: {exc}")
 
+def deploy_from_archive(repo_url, temp_base_dir, venv_path):
+    """Download, extract and install library from archive; return import name."""
+    temp_download_dir = Path(temp_base_dir) / "download"
+    temp_download_dir.mkdir(exist_ok=True)
+    temp_extract_dir = Path(temp_base_dir) / "extracted"
+    temp_extract_dir.mkdir(exist_ok=True)
+    zip_buffer = download_repo_zip(repo_url, temp_download_dir)
+    if zip_buffer is None:
+        return None
+    with zip_buffer:
+        extracted_content_path = extract_repo_zip(zip_buffer, temp_extract_dir)
+    if not extracted_content_path:
+        return None
+    library_root_path = find_library_root(extracted_content_path)
+    if not library_root_path:
+        return None
+    library_name_for_import = guess_package_name(library_root_path)
+    if not library_name_for_import:
+        logging.error("Не удалось определить имя пакета для импорта.")
+        return None
+    if not install_library_in_venv(venv_path, library_root_path):
+        return None
+    return library_name_for_import
+
 def main():
     logging.info("Начало процесса развертывания Python библиотеки.")
     repo_url_str = None
     venv_dir_path = None
     paths_to_clean = []
+    background_cleanup = None
     try:
         repo_url_str = get_repo_url_from_env()
         if not repo_url_str:
@@ -188,28 +439,36 @@ def main():
         temp_base_dir = Path(tempfile.mkdtemp(prefix="codex_lib_deploy_"))
         paths_to_clean.append(temp_base_dir)
         logging.info(f"Создана временная директория: {temp_base_dir}")
-        temp_download_dir = temp_base_dir / "download"
-        temp_download_dir.mkdir()
-        temp_extract_dir = temp_base_dir / "extracted"
-        temp_extract_dir.mkdir()
         venv_dir_path = temp_base_dir / "venv"
-        zip_file_path = download_repo_zip(repo_url_str, temp_download_dir)
-        if not zip_file_path:
-            return
-        extracted_content_path = extract_repo_zip(zip_file_path, temp_extract_dir)
-        if not extracted_content_path:
-            return
-        library_root_path = find_library_root(extracted_content_path)
-        if not library_root_path:
+        # Branch probing does not need the venv, so it runs while the venv and pip are bootstrapped.
+        # This is the only overlap left: for a .zip URL or a configured branch there is nothing
+        # to probe, and the fallback download/extraction runs only after the direct install failed.
+        with ThreadPoolExecutor(max_workers=1) as venv_executor:
+            venv_future = venv_executor.submit(create_virtual_env, venv_dir_path)
+            zip_url = build_zip_url(repo_url_str)
+            venv_created = venv_future.result()
+        if not venv_created:
             return
-        library_name_for_import = guess_package_name(library_root_path)
+        # pip can install straight from the archive URL, skipping our own download and extraction.
+        expected_sha256 = get_expected_sha256_from_env()
+        # pip verifies a "#sha256=" fragment on direct archive URLs.
+        install_target = f"{zip_url}#sha256={expected_sha256}" if expected_sha256 else zip_url
+        if install_library_in_venv(venv_dir_path, install_target):
+            library_name_for_import = find_installed_package_name(venv_dir_path)
+            if not library_name_for_import:
+                repo_name = get_repo_name_from_url(repo_url_str)
+                library_name_for_import = repo_name.replace("-", "_") if repo_name else None
+        else:
+            logging.warning("Прямая установка из архива не удалась, выполняется загрузка и распаковка.")
+            library_name_for_import = deploy_from_archive(zip_url, temp_base_dir, venv_dir_path)
         if not library_name_for_import:
-            logging.error("Не удалось определить имя пакета для импорта.")
-            return
-        if not create_virtual_env(venv_dir_path):
-            return
-        if not install_library_in_venv(venv_dir_path, library_root_path):
             return
+        # Sources are no longer needed once installed; remove them while the demonstration runs.
+        # Only the archive fallback creates these directories, so the direct path starts no thread.
+        stale_dirs = [p for p in (temp_base_dir / "download", temp_base_dir / "extracted") if p.exists()]
+        if stale_dirs:
+            background_cleanup = threading.Thread(target=cleanup, args=(stale_dirs,))
+            background_cleanup.start()
         logging.info("Попытка запуска демонстрационного кода (если реализовано)...")
         run_demonstration(venv_dir_path, library_name_for_import)
         logging.info("Процесс успешно завершен.")
@@ -217,6 +476,8 @@ def main():
         logging.error(f"Произошла критическая ошибка: {exc}", exc_info=True)
     finally:
         logging.info("Запуск процесса очистки...")
+        if background_cleanup is not None:
+            background_cleanup.join()
         cleanup(paths_to_clean)
         logging.info("Очистка завершена.")
 
@@ -4,7 +4,8 @@ import sys
 import subprocess
 import zipfile
 import io
-import runpy
+import hashlib
+import time
 import contextlib
 from pathlib import Path
 from unittest import mock, TestCase
@@ -16,11 +17,24 @@ class DummyResponse:
     def __init__(self, data: bytes):
         self.data = data
         self.status_code = 200
+        self.raw = io.BytesIO(data)
+        self.headers = {'Content-Length': str(len(data))}
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        return False
     def raise_for_status(self):
         pass
     def iter_content(self, chunk_size=1):
         yield self.data
 
+@contextlib.contextmanager
+def parallel_extraction():
+    """Force extract_repo_zip onto its thread-pool path regardless of host and archive size."""
+    with mock.patch('os.cpu_count', return_value=4), \
+            mock.patch.object(dl, 'PARALLEL_EXTRACT_MIN_MEMBERS', 0):
+        yield
+
 class DeployLibraryTests(TestCase):
     def test_get_repo_url_from_env_missing(self):
         with mock.patch.dict(os.environ, {}, clear=True):
@@ -35,15 +49,85 @@ class DeployLibraryTests(TestCase):
         url_repo = 'https://github.com/user/repo'
         self.assertEqual(dl.get_repo_name_from_url(url_zip), 'repo')
         self.assertEqual(dl.get_repo_name_from_url(url_repo), 'repo')
+        self.assertEqual(dl.get_repo_name_from_url('https://github.com/user/repo/'), 'repo')
+        self.assertEqual(dl.get_repo_name_from_url('https://github.com/user/repo/archive'), 'repo')
+        self.assertEqual(dl.get_repo_name_from_url('https://github.com/user/repo/archive/'), 'repo')
+        self.assertEqual(dl.get_repo_name_from_url('https://example.com/files/repo.zip'), 'repo')
+        self.assertIsNone(dl.get_repo_name_from_url('https://github.com'))
+
+    def test_build_zip_url(self):
+        with mock.patch.dict(os.environ, {}, clear=True), \
+                mock.patch.object(dl._SESSION, 'head', return_value=DummyResponse(b'')):
+            self.assertEqual(
+                dl.build_zip_url('https://github.com/user/repo/'),
+                'https://github.com/user/repo/archive/refs/heads/main.zip'
+            )
+        url_zip = 'https://github.com/user/repo/archive/refs/heads/dev.zip'
+        self.assertEqual(dl.build_zip_url(url_zip), url_zip)
+
+    def test_build_zip_url_probes_master(self):
+        def fake_head(url, **kwargs):
+            response = DummyResponse(b'')
+            response.status_code = 200 if url.endswith('/master.zip') else 404
+            return response
+
+        with mock.patch.dict(os.environ, {}, clear=True), \
+                mock.patch.object(dl._SESSION, 'head', side_effect=fake_head) as mock_head:
+            self.assertEqual(
+                dl.build_zip_url('https://github.com/user/repo'),
+                'https://github.com/user/repo/archive/refs/heads/master.zip'
+            )
+            self.assertEqual(mock_head.call_count, 2)
+
+    def test_download_repo_zip_expected_sha256(self):
+        dummy_data = b'TESTDATA'
+        digest = hashlib.sha256(dummy_data).hexdigest()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            temp_path = Path(tmpdir)
+            with mock.patch.dict(os.environ, {dl.EXPECTED_SHA256_ENV_VAR: digest.upper()}), \
+                    mock.patch.object(dl._SESSION, 'get', return_value=DummyResponse(dummy_data)):
+                zip_buffer = dl.download_repo_zip('https://example.com/repo.zip', temp_path)
+                self.assertIsNotNone(zip_buffer)
+                zip_buffer.close()
+            with mock.patch.dict(os.environ, {dl.EXPECTED_SHA256_ENV_VAR: '0' * 64}), \
+                    mock.patch.object(dl._SESSION, 'get', return_value=DummyResponse(dummy_data)):
+                self.assertIsNone(dl.download_repo_zip('https://example.com/repo.zip', temp_path))
+
+    def test_download_repo_zip_large_archive_goes_to_disk(self):
+        response = DummyResponse(b'DATA')
+        response.headers['Content-Length'] = str(dl.ZIP_SPOOL_MAX_SIZE + 1)
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.object(dl._SESSION, 'get', return_value=response), \
+                mock.patch.object(tempfile.SpooledTemporaryFile, 'rollover') as mock_rollover:
+            zip_buffer = dl.download_repo_zip('https://example.com/repo.zip', Path(tmpdir))
+            self.assertIsNotNone(zip_buffer)
+            zip_buffer.close()
+            mock_rollover.assert_called_once_with()
+
+    def test_download_repo_zip_branch_override(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.dict(os.environ, {dl.BRANCH_ENV_VAR: 'dev'}), \
+                mock.patch.object(dl._SESSION, 'head') as mock_head, \
+                mock.patch.object(dl._SESSION, 'get', return_value=DummyResponse(b'DATA')) as mock_get:
+            zip_buffer = dl.download_repo_zip('https://github.com/user/repo', Path(tmpdir))
+            self.assertIsNotNone(zip_buffer)
+            zip_buffer.close()
+            mock_head.assert_not_called()
+            self.assertEqual(
+                mock_get.call_args[0][0],
+                'https://github.com/user/repo/archive/refs/heads/dev.zip'
+            )
 
     def test_download_repo_zip(self):
         dummy_data = b'TESTDATA'
         with tempfile.TemporaryDirectory() as tmpdir:
             temp_path = Path(tmpdir)
-            with mock.patch('requests.get', return_value=DummyResponse(dummy_data)):
-                zip_path = dl.download_repo_zip('https://example.com/repo.zip', temp_path)
-                self.assertIsNotNone(zip_path)
-                self.assertEqual(zip_path.read_bytes(), dummy_data)
+            with mock.patch.object(dl._SESSION, 'get', return_value=DummyResponse(dummy_data)):
+                zip_buffer = dl.download_repo_zip('https://example.com/repo.zip', temp_path)
+                self.assertIsNotNone(zip_buffer)
+                with zip_buffer:
+                    self.assertEqual(zip_buffer.read(), dummy_data)
+                self.assertEqual(list(temp_path.iterdir()), [])
 
     def test_extract_repo_zip(self):
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -56,6 +140,101 @@ class DeployLibraryTests(TestCase):
             self.assertIsNotNone(dl.extract_repo_zip(zip_file, extract_dir))
             self.assertTrue((extract_dir / 'file.txt').is_file())
 
+    def test_extract_repo_zip_from_buffer(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for i in range(20):
+                    zf.writestr(f'repo-main/mod{i}.py', f'value = {i}\n')
+            buffer.seek(0)
+            with parallel_extraction():
+                self.assertIsNotNone(dl.extract_repo_zip(buffer, tmp_path))
+            self.assertEqual((tmp_path / 'repo-main' / 'mod13.py').read_text(), 'value = 13\n')
+
+    def test_extract_repo_zip_from_spilled_buffer(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            with tempfile.SpooledTemporaryFile(max_size=16, dir=tmpdir) as buffer:
+                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    for i in range(20):
+                        zf.writestr(f'repo-main/mod{i}.py', f'value = {i}\n')
+                buffer.seek(0)
+                self.assertIsNotNone(buffer.name)
+                with parallel_extraction():
+                    self.assertIsNotNone(dl.extract_repo_zip(buffer, tmp_path))
+            self.assertEqual((tmp_path / 'repo-main' / 'mod5.py').read_text(), 'value = 5\n')
+
+    def test_mapped_zip_reader_rejects_negative_seek(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data_file = Path(tmpdir) / 'data.bin'
+            data_file.write_bytes(b'0123456789')
+            with open(data_file, 'rb') as fh, \
+                    dl.mmap.mmap(fh.fileno(), 0, access=dl.mmap.ACCESS_READ) as mapping:
+                reader = dl._MappedZipReader(mapping)
+                self.assertEqual(reader.seek(-4, io.SEEK_END), 6)
+                self.assertEqual(reader.read(22), b'6789')
+                with self.assertRaises(OSError):
+                    reader.seek(-22, io.SEEK_END)
+                self.assertEqual(reader.tell(), 10)
+            extract_dir = Path(tmpdir) / 'extract'
+            extract_dir.mkdir()
+            self.assertIsNone(dl.extract_repo_zip(data_file, extract_dir))
+
+    def test_extract_repo_zip_nested_members(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            zip_file = tmp_path / 'archive.zip'
+            with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr('repo-main/', '')
+                for i in range(20):
+                    zf.writestr(f'repo-main/pkg/mod{i}.py', f'value = {i}\n')
+            extract_dir = tmp_path / 'extract'
+            extract_dir.mkdir()
+            with parallel_extraction():
+                self.assertIsNotNone(dl.extract_repo_zip(zip_file, extract_dir))
+            self.assertEqual((extract_dir / 'repo-main' / 'pkg' / 'mod7.py').read_text(), 'value = 7\n')
+
+    def test_extract_repo_zip_rejects_path_traversal(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            zip_file = tmp_path / 'archive.zip'
+            with zipfile.ZipFile(zip_file, 'w') as zf:
+                zf.writestr('../evil.txt', 'content')
+            extract_dir = tmp_path / 'extract'
+            extract_dir.mkdir()
+            with parallel_extraction():
+                self.assertIsNone(dl.extract_repo_zip(zip_file, extract_dir))
+            self.assertFalse((tmp_path / 'evil.txt').exists())
+
+    def test_extract_repo_zip_sanitizes_windows_names(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            zip_file = tmp_path / 'archive.zip'
+            with zipfile.ZipFile(zip_file, 'w') as zf:
+                zf.writestr('repo-main/docs/a:b?.md', 'content')
+            extract_dir = tmp_path / 'extract'
+            extract_dir.mkdir()
+            with parallel_extraction(), mock.patch.object(dl.os, 'name', 'nt'):
+                self.assertIsNotNone(dl.extract_repo_zip(zip_file, extract_dir))
+            self.assertEqual((extract_dir / 'repo-main' / 'docs' / 'a_b_.md').read_text(), 'content')
+            self.assertFalse((extract_dir / 'repo-main' / 'docs' / 'a:b?.md').exists())
+
+    def test_extract_repo_zip_small_archive_uses_extractall(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            zip_file = tmp_path / 'archive.zip'
+            with zipfile.ZipFile(zip_file, 'w') as zf:
+                zf.writestr('../evil.txt', 'content')
+            extract_dir = tmp_path / 'extract'
+            extract_dir.mkdir()
+            with mock.patch.object(zipfile.ZipFile, 'extractall', autospec=True,
+                                   side_effect=zipfile.ZipFile.extractall) as mock_extractall:
+                self.assertIsNotNone(dl.extract_repo_zip(zip_file, extract_dir))
+            mock_extractall.assert_called_once()
+            self.assertFalse((tmp_path / 'evil.txt').exists())
+            self.assertTrue((extract_dir / 'evil.txt').is_file())
+
     def test_find_library_root(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             tmp_path = Path(tmpdir)
@@ -73,14 +252,43 @@ class DeployLibraryTests(TestCase):
             self.assertEqual(dl.guess_package_name(tmp_path), 'mypkg')
 
     def test_create_virtual_env(self):
-        with mock.patch('subprocess.run') as mock_run:
-            mock_run.return_value = subprocess.CompletedProcess([], 0)
+        with mock.patch('venv.EnvBuilder.create') as mock_create:
             self.assertTrue(dl.create_virtual_env(Path('venv')))
+            mock_create.assert_called_once_with('venv')
+
+    def test_create_virtual_env_failure(self):
+        with mock.patch('venv.EnvBuilder.create', side_effect=OSError('boom')):
+            self.assertFalse(dl.create_virtual_env(Path('venv')))
 
     def test_install_library_in_venv(self):
-        with mock.patch('subprocess.run') as mock_run:
+        with mock.patch('shutil.which', return_value=None), mock.patch('subprocess.run') as mock_run:
+            mock_run.return_value = subprocess.CompletedProcess([], 0)
+            self.assertTrue(dl.install_library_in_venv(Path('venv'), Path('lib')))
+            args = mock_run.call_args[0][0]
+            self.assertIn('--quiet', args)
+            self.assertEqual(args[-1], 'lib')
+            self.assertEqual(mock_run.call_args[1]['stdout'], subprocess.DEVNULL)
+
+    def test_install_library_in_venv_failure(self):
+        with mock.patch('shutil.which', return_value=None), mock.patch('subprocess.run') as mock_run:
+            mock_run.return_value = subprocess.CompletedProcess([], 1, stderr='error')
+            self.assertFalse(dl.install_library_in_venv(Path('venv'), Path('lib')))
+
+    def test_install_library_in_venv_prefers_uv(self):
+        with mock.patch('shutil.which', return_value='/usr/bin/uv'), mock.patch('subprocess.run') as mock_run:
             mock_run.return_value = subprocess.CompletedProcess([], 0)
             self.assertTrue(dl.install_library_in_venv(Path('venv'), Path('lib')))
+            args = mock_run.call_args[0][0]
+            self.assertEqual(args[:4], ['/usr/bin/uv', 'pip', 'install', '--python'])
+            self.assertEqual(args[-1], 'lib')
+
+    def test_find_installed_package_name(self):
+        with mock.patch('subprocess.run') as mock_run:
+            mock_run.return_value = subprocess.CompletedProcess([], 0, stdout='yaml\n', stderr='')
+            self.assertEqual(dl.find_installed_package_name(Path('venv')), 'yaml')
+            self.assertEqual(mock_run.call_args[0][0][1:], ['-c', dl._INSTALLED_PACKAGE_CODE])
+            mock_run.return_value = subprocess.CompletedProcess([], 0, stdout='', stderr='')
+            self.assertIsNone(dl.find_installed_package_name(Path('venv')))
 
     def test_cleanup(self):
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -91,6 +299,36 @@ class DeployLibraryTests(TestCase):
             dl.cleanup([dir_to_remove])
             self.assertFalse(dir_to_remove.exists())
 
+    def test_cleanup_readonly_and_missing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            dir_to_remove = tmp_path / 'dir'
+            dir_to_remove.mkdir()
+            readonly_file = dir_to_remove / 'readonly.txt'
+            readonly_file.write_text('data')
+            readonly_file.chmod(0o444)
+            dl.cleanup([dir_to_remove, tmp_path / 'missing'])
+            self.assertFalse(dir_to_remove.exists())
+
+    def test_remove_readonly_ignores_non_removal_calls(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dir_path = Path(tmpdir) / 'dir'
+            dir_path.mkdir()
+            dir_path.chmod(0o200)
+            try:
+                dl._remove_readonly(os.open, str(dir_path), PermissionError('denied'))
+                self.assertTrue(dir_path.exists())
+            finally:
+                dir_path.chmod(0o700)
+
+    def test_remove_readonly_retries_removal(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dir_path = Path(tmpdir) / 'dir'
+            dir_path.mkdir()
+            dir_path.chmod(0o500)
+            dl._remove_readonly(os.rmdir, str(dir_path), PermissionError('denied'))
+            self.assertFalse(dir_path.exists())
+
     def test_run_demonstration_dunder_version(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             tmp_path = Path(tmpdir)
@@ -101,10 +339,10 @@ class DeployLibraryTests(TestCase):
             captured = {}
 
             def fake_run(args, capture_output=False, text=False):
-                script_path = args[1]
+                self.assertEqual(args[1], '-c')
                 stdout_io = io.StringIO()
                 with contextlib.redirect_stdout(stdout_io):
-                    runpy.run_path(script_path, run_name='__main__')
+                    exec(args[2], {'__name__': '__main__'})
                 cp = subprocess.CompletedProcess(args, 0, stdout=stdout_io.getvalue(), stderr='')
                 captured['cp'] = cp
                 return cp
@@ -128,10 +366,10 @@ class DeployLibraryTests(TestCase):
             captured = {}
 
             def fake_run(args, capture_output=False, text=False):
-                script_path = args[1]
+                self.assertEqual(args[1], '-c')
                 stdout_io = io.StringIO()
                 with contextlib.redirect_stdout(stdout_io):
-                    runpy.run_path(script_path, run_name='__main__')
+                    exec(args[2], {'__name__': '__main__'})
                 cp = subprocess.CompletedProcess(args, 0, stdout=stdout_io.getvalue(), stderr='')
                 captured['cp'] = cp
                 return cp
@@ -144,3 +382,89 @@ class DeployLibraryTests(TestCase):
                 'Версия библиотеки otherlib: 2.5.1'
             )
             sys.path.pop(0)
+
+    def _zip_bytes(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('repo-main/pkg/__init__.py', "__version__ = '1.0'")
+        return buffer.getvalue()
+
+    def _recording_mkdtemp(self, created):
+        real_mkdtemp = tempfile.mkdtemp
+
+        def fake_mkdtemp(*args, **kwargs):
+            path = real_mkdtemp(*args, **kwargs)
+            created.append(Path(path))
+            return path
+
+        return mock.patch('tempfile.mkdtemp', side_effect=fake_mkdtemp)
+
+    def test_main_direct_install(self):
+        digest = 'a' * 64
+        env = {dl.REPO_URL_ENV_VAR: 'https://github.com/user/repo', dl.EXPECTED_SHA256_ENV_VAR: digest}
+        created = []
+        with mock.patch.dict(os.environ, env, clear=True), \
+                self._recording_mkdtemp(created), \
+                mock.patch.object(dl._SESSION, 'head', return_value=DummyResponse(b'')), \
+                mock.patch.object(dl._SESSION, 'get') as mock_get, \
+                mock.patch.object(dl, 'create_virtual_env', return_value=True), \
+                mock.patch.object(dl, 'install_library_in_venv', return_value=True) as mock_install, \
+                mock.patch.object(dl, 'find_installed_package_name', return_value='pkg'), \
+                mock.patch.object(dl, 'deploy_from_archive') as mock_fallback, \
+                mock.patch.object(dl, 'cleanup', wraps=dl.cleanup) as mock_cleanup, \
+                mock.patch.object(dl, 'run_demonstration') as mock_demo:
+            dl.main()
+        zip_url = 'https://github.com/user/repo/archive/refs/heads/main.zip'
+        mock_install.assert_called_once_with(mock.ANY, f'{zip_url}#sha256={digest}')
+        mock_fallback.assert_not_called()
+        mock_get.assert_not_called()
+        mock_demo.assert_called_once_with(mock.ANY, 'pkg')
+        self.assertEqual(len(created), 1)
+        mock_cleanup.assert_called_once_with([created[0]])
+        self.assertFalse(created[0].exists())
+
+    def test_main_falls_back_to_archive_after_failed_direct_install(self):
+        zip_data = self._zip_bytes()
+        digest = hashlib.sha256(zip_data).hexdigest()
+        env = {dl.REPO_URL_ENV_VAR: 'https://github.com/user/repo', dl.EXPECTED_SHA256_ENV_VAR: digest}
+        created = []
+        events = []
+        real_cleanup = dl.cleanup
+
+        def slow_cleanup(paths):
+            events.append(('start', len(paths)))
+            if len(paths) > 1:
+                time.sleep(0.2)
+            real_cleanup(paths)
+            events.append(('end', len(paths)))
+
+        with mock.patch.dict(os.environ, env, clear=True), \
+                self._recording_mkdtemp(created), \
+                mock.patch.object(dl._SESSION, 'head', return_value=DummyResponse(b'')), \
+                mock.patch.object(dl._SESSION, 'get', return_value=DummyResponse(zip_data)) as mock_get, \
+                mock.patch.object(dl, 'create_virtual_env', return_value=True), \
+                mock.patch.object(dl, 'install_library_in_venv', side_effect=[False, True]) as mock_install, \
+                mock.patch.object(dl, 'find_installed_package_name') as mock_find, \
+                mock.patch.object(dl, 'cleanup', side_effect=slow_cleanup) as mock_cleanup, \
+                mock.patch.object(dl, 'run_demonstration') as mock_demo:
+            dl.main()
+        zip_url = 'https://github.com/user/repo/archive/refs/heads/main.zip'
+        self.assertEqual(mock_install.call_count, 2)
+        self.assertEqual(mock_install.call_args_list[0][0][1], f'{zip_url}#sha256={digest}')
+        library_root = mock_install.call_args_list[1][0][1]
+        self.assertEqual(library_root.name, 'repo-main')
+        mock_get.assert_called_once_with(zip_url, stream=True, timeout=30)
+        mock_find.assert_not_called()
+        mock_demo.assert_called_once_with(mock.ANY, 'pkg')
+        self.assertEqual(len(created), 1)
+        base_dir = created[0]
+        # Background cleanup of the sources, then the joined final cleanup of the base dir.
+        self.assertEqual(
+            mock_cleanup.call_args_list,
+            [mock.call([base_dir / 'download', base_dir / 'extracted']), mock.call([base_dir])]
+        )
+        # The final cleanup waits for the background thread to finish.
+        self.assertEqual(events, [('start', 2), ('end', 2), ('start', 1), ('end', 1)])
+        self.assertFalse((base_dir / 'download').exists())
+        self.assertFalse((base_dir / 'extracted').exists())
+        self.assertFalse(base_dir.exists())